@@ -3,20 +3,34 @@ Retro-Styled Coding Project Token & Cost Estimator for Claude and Gemini
 
 Features:
 - Automatic iteration estimation based on prompt length & coding keywords
-- Slight randomness added to iterations
+- Slight randomness added to iterations (disable with --deterministic)
+- Input token counts via tiktoken BPE (cl100k_base), char/word heuristic fallback
 - Input/output token estimation includes prompt quality factor
 - Retro dark gray background with muted olive green text
 - Prompt input box background matches UI background, text is muted olive green
 - Saves last calculation to last_estimate.json
 """
 
+import hashlib
 import json
-import math
+import os
 import random
-from prompt_toolkit import print_formatted_text, prompt
-from prompt_toolkit.formatted_text import FormattedText
-from prompt_toolkit.styles import Style
-from prompt_toolkit.shortcuts import checkboxlist_dialog
+import re
+import warnings
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict, namedtuple
+from functools import lru_cache
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 # --- Pricing ---
 PRICING = {
@@ -25,8 +39,13 @@ PRICING = {
 }
 USD_TO_EUR = 0.92
 
+# Flat per-model EUR-per-token rates derived from PRICING, indexed via _MODEL_IDX
+_MODEL_IDX = {m: i for i, m in enumerate(PRICING)}
+_IN_EUR_PER_TOKEN = array("d", (p["input_per_m"] * USD_TO_EUR / 1_000_000 for p in PRICING.values()))
+_OUT_EUR_PER_TOKEN = array("d", (p["output_per_m"] * USD_TO_EUR / 1_000_000 for p in PRICING.values()))
+
 # --- Coding keywords ---
-CODING_KEYWORDS = [
+_CODING_KEYWORDS_RAW = [
     "code", "function", "script", "class", "module", "package",
     "algorithm", "refactor", "optimize", "debug", "compile",
     "build", "deploy", "test", "integration", "unit test",
@@ -38,9 +57,31 @@ CODING_KEYWORDS = [
     "threading", "async", "await", "docker", "container", "microservice",
     "refactoring", "optimization", "version control", "git", "merge", "branch"
 ]
+CODING_KEYWORDS = frozenset(kw.lower() for kw in _CODING_KEYWORDS_RAW)
+
+# Single-word keywords are matched as whole words via a hash lookup, with
+# simple plurals ("tests", "classes") folded onto the keyword; the few
+# phrases ("unit test", "ci/cd", ...) are matched as substrings, but only
+# scanned for when their leading word occurs in the prompt.
+_WORD_RE = re.compile(r"[a-z]+")
+KW_SET = frozenset(kw for kw in CODING_KEYWORDS if kw.isalpha())
+_KW_PHRASES = tuple(
+    (_WORD_RE.match(kw).group(), kw)
+    for kw in sorted(CODING_KEYWORDS) if not kw.isalpha()
+)
+
+# --- Heuristic tuning ---
+# Prompt-size buckets: < 50 tokens, 50-200 tokens, > 200 tokens
+_TOKEN_BUCKETS = (50, 201)
+_ITER_BASE = (2, 5, 15)
+_OUTPUT_MULTIPLIER = (10, 8, 5)
+
+_rng = random.Random()
 
 # --- Retro UI Style ---
-retro_style = Style.from_dict({
+# Plain rules only; prompt_toolkit is imported lazily in main() so the
+# estimator functions can be imported without the TUI stack.
+RETRO_STYLE_RULES = {
     "dialog": "bg:#2e2e2e",
     "dialog.frame-label": "bg:#2e2e2e #9aa65e bold",
     "dialog.body": "bg:#2e2e2e #9aa65e",
@@ -51,64 +92,201 @@ retro_style = Style.from_dict({
     "checkbox.focused": "bg:#9aa65e #2e2e2e bold",
     "prompt": "bg:#2e2e2e #9aa65e",           # prompt label
     "input-field": "bg:#2e2e2e #9aa65e",       # input text area
-})
+}
+
+@lru_cache(maxsize=None)
+def _get_retro_style():
+    from prompt_toolkit.styles import Style
+    return Style.from_dict(RETRO_STYLE_RULES)
+
+# --- Tokenizer ---
+# Claude and Gemini don't publish their tokenizers; cl100k_base is a much
+# closer proxy than the char/word heuristics, which remain as the fallback.
+# Resolved on first use so importing the module doesn't load the rank table.
+@lru_cache(maxsize=None)
+def _get_encoder(encoding_name: str = "cl100k_base"):
+    # The first load may download the rank file. If that fails (offline,
+    # blocked download, corrupt cache) fall back to the char/word heuristics
+    # with a single warning; the cache keeps the fallback from being retried.
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.get_encoding(encoding_name)
+    except (OSError, ValueError) as exc:
+        warnings.warn(
+            f"could not load tiktoken encoding {encoding_name!r} ({exc}); "
+            "falling back to char/word token estimates",
+            RuntimeWarning,
+            stacklevel=2,
+        )
+        return None
 
 # --- Token estimation functions ---
+def _count_words(text: str) -> int:
+    # A space count avoids split()'s per-word allocations, but it only matches
+    # split() for ASCII text whose sole whitespace is single inner spaces;
+    # anything else (other ASCII or Unicode whitespace, runs, edges) splits.
+    # Newlines are checked first so multi-line text bails after one scan.
+    if (
+        "\n" in text
+        or not text
+        or not text.isascii()
+        or text[0] == " "
+        or text[-1] == " "
+        or "  " in text
+        or any(ws in text for ws in "\t\x0b\x0c\r\x1c\x1d\x1e\x1f")
+    ):
+        return len(text.split())
+    return text.count(" ") + 1
+
+def count_keyword_hits(prompt_lower: str) -> int:
+    # Number of distinct keywords present in the prompt
+    words = set(_WORD_RE.findall(prompt_lower))
+    matched = words.intersection(KW_SET)
+    for w in words.difference(matched):
+        if w.endswith("s"):
+            if w[:-1] in KW_SET:
+                matched.add(w[:-1])
+            elif w.endswith("es") and w[:-2] in KW_SET:
+                matched.add(w[:-2])
+    return len(matched) + sum(1 for lead, phrase in _KW_PHRASES if lead in words and phrase in prompt_lower)
+
 def estimate_tokens_by_chars(text: str) -> int:
-    return max(1, math.ceil(len(text) / 4))
+    return max(1, (len(text) + 3) >> 2)
 
 def estimate_tokens_by_words(text: str) -> int:
-    words = len(text.split())
-    return max(1, int(words / 0.75))
+    return max(1, _count_words(text) * 4 // 3)
 
 def estimate_input_tokens(prompt_text: str) -> int:
+    encoder = _get_encoder()
+    if encoder is not None:
+        return max(1, len(encoder.encode_ordinary(prompt_text)))
     tokens_chars = estimate_tokens_by_chars(prompt_text)
     tokens_words = estimate_tokens_by_words(prompt_text)
     return int((tokens_chars + tokens_words) / 2)
 
-def deduce_iterations(prompt_text: str, prompt_tokens: int) -> int:
-    prompt_lower = prompt_text.lower()
-    if prompt_tokens < 50:
-        base_iterations = 2
-    elif prompt_tokens <= 200:
-        base_iterations = 5
-    else:
-        base_iterations = 15
+def estimate_input_tokens_batch(prompt_texts: list[str]) -> list[int]:
+    encoder = _get_encoder()
+    if encoder is None:
+        return [estimate_input_tokens(t) for t in prompt_texts]
+    encoded = encoder.encode_ordinary_batch(prompt_texts, num_threads=os.cpu_count() or 1)
+    return [max(1, len(tokens)) for tokens in encoded]
+
+# Prompt-derived counts, computed once per distinct prompt and passed to the
+# heuristics. Cached by prompt digest so entries don't keep whole prompts
+# alive; the iteration jitter is applied after lookup, outside the cache.
+_PromptStats = namedtuple("_PromptStats", "input_tokens keyword_hits word_count")
+_ANALYSIS_CACHE_SIZE = 256
+_analysis_cache: "OrderedDict[bytes, _PromptStats]" = OrderedDict()
+
+def _text_counts(prompt_text: str) -> tuple[int, int]:
+    # String-derived inputs to the heuristics: (keyword_hits, word_count)
+    return count_keyword_hits(prompt_text.lower()), _count_words(prompt_text)
+
+def _analyze_prompt(prompt_text: str) -> _PromptStats:
+    key = hashlib.blake2b(prompt_text.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+    stats = _analysis_cache.get(key)
+    if stats is not None:
+        _analysis_cache.move_to_end(key)
+        return stats
+    stats = _PromptStats(estimate_input_tokens(prompt_text), *_text_counts(prompt_text))
+    _analysis_cache[key] = stats
+    if len(_analysis_cache) > _ANALYSIS_CACHE_SIZE:
+        _analysis_cache.popitem(last=False)
+    return stats
 
-    keyword_hits = sum(1 for kw in CODING_KEYWORDS if kw in prompt_lower)
+def deduce_iterations(prompt_tokens: int, keyword_hits: int, *, deterministic: bool = False) -> int:
+    base_iterations = _ITER_BASE[bisect_right(_TOKEN_BUCKETS, prompt_tokens)]
     estimated_iterations = base_iterations + keyword_hits
 
-    # Add ±10% randomness
-    random_factor = random.uniform(0.9, 1.1)
+    # Add ±10% randomness unless a reproducible estimate was requested
+    random_factor = 1.0 if deterministic else 0.9 + _rng.random() * 0.2
     return max(1, int(estimated_iterations * random_factor))
 
-def estimate_output_tokens_per_iteration(prompt_text: str, prompt_tokens: int) -> int:
-    keyword_hits = sum(1 for kw in CODING_KEYWORDS if kw in prompt_text.lower())
-    quality_factor = 1 + (keyword_hits / max(1, len(prompt_text.split())))
-    
-    if prompt_tokens < 50:
-        multiplier = 10
-    elif prompt_tokens <= 200:
-        multiplier = 8
-    else:
-        multiplier = 5
-
+def estimate_output_tokens_per_iteration(prompt_tokens: int, keyword_hits: int, word_count: int) -> int:
+    quality_factor = 1 + (keyword_hits / max(1, word_count))
+    multiplier = _OUTPUT_MULTIPLIER[bisect_right(_TOKEN_BUCKETS, prompt_tokens)]
     return int(prompt_tokens * multiplier * quality_factor)
 
 def calculate_cost(tokens_input: int, tokens_output: int, model: str) -> float:
-    price = PRICING.get(model)
-    if not price:
+    i = _MODEL_IDX.get(model)
+    if i is None:
         return 0.0
-    cost_usd = (tokens_input / 1_000_000) * price["input_per_m"]
-    cost_usd += (tokens_output / 1_000_000) * price["output_per_m"]
-    return float(f"{cost_usd * USD_TO_EUR:.8f}")
+    cost_eur = tokens_input * _IN_EUR_PER_TOKEN[i] + tokens_output * _OUT_EUR_PER_TOKEN[i]
+    return round(cost_eur, 8)
+
+# O_BINARY keeps Windows from translating newlines on the raw fd
+_SAVE_FLAGS = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0)
 
 def save_last(data: dict):
-    with open("last_estimate.json", "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2)
+    if orjson is not None:
+        payload = orjson.dumps(data, option=orjson.OPT_INDENT_2)
+    else:
+        payload = json.dumps(data, indent=2, ensure_ascii=False).encode("utf-8")
+    fd = os.open("last_estimate.json", _SAVE_FLAGS, 0o666)
+    try:
+        view = memoryview(payload)
+        while view:
+            view = view[os.write(fd, view):]
+    finally:
+        os.close(fd)
+
+def _score_prompt(input_tokens: int, keyword_hits: int, word_count: int, models,
+                  *, deterministic: bool = False) -> dict:
+    # Numeric core shared by the single and batch paths; no string work here
+    iterations = deduce_iterations(input_tokens, keyword_hits, deterministic=deterministic)
+    output_tokens_per_iter = estimate_output_tokens_per_iteration(
+        input_tokens, keyword_hits, word_count
+    )
+    total_output_tokens = output_tokens_per_iter * iterations
+    total_input_tokens = input_tokens * iterations
+
+    results = {}
+    for m in models:
+        cost = calculate_cost(total_input_tokens, total_output_tokens, m)
+        results[m] = {
+            "estimated_iterations": iterations,
+            "input_tokens_per_prompt": input_tokens,
+            "total_input_tokens": total_input_tokens,
+            "output_tokens_per_iteration": output_tokens_per_iter,
+            "total_output_tokens": total_output_tokens,
+            "estimated_cost_eur": cost
+        }
+    return results
+
+def estimate_session(prompt_text: str, models, *, deterministic: bool = False) -> dict:
+    # Full estimate for one prompt without any prompt_toolkit UI
+    stats = _analyze_prompt(prompt_text)
+    return _score_prompt(
+        stats.input_tokens, stats.keyword_hits, stats.word_count, models,
+        deterministic=deterministic,
+    )
+
+def estimate_batch(prompt_texts: list[str], models, *, deterministic: bool = False) -> list[dict]:
+    # Tokenize all prompts in one batched encode, then score each
+    input_tokens = estimate_input_tokens_batch(prompt_texts)
+    return [
+        _score_prompt(n, *_text_counts(t), models, deterministic=deterministic)
+        for n, t in zip(input_tokens, prompt_texts)
+    ]
 
 # --- Main Program ---
-def main():
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Estimate token usage and cost for a coding prompt.")
+    parser.add_argument(
+        "--deterministic", action="store_true",
+        help="disable the ±10%% iteration jitter so repeated runs give identical estimates",
+    )
+    args = parser.parse_args(argv)
+
+    from prompt_toolkit import print_formatted_text, prompt
+    from prompt_toolkit.formatted_text import FormattedText
+    from prompt_toolkit.shortcuts import checkboxlist_dialog
+
+    retro_style = _get_retro_style()
+
     # Model selection
     models = checkboxlist_dialog(
         title="Select Model(s)",
@@ -132,42 +310,28 @@ def main():
         print_formatted_text(FormattedText([("class:dialog.body", "Prompt is empty. Exiting.\n")]), style=retro_style)
         return
 
-    # Token estimation
-    input_tokens = estimate_input_tokens(prompt_text)
-    iterations = deduce_iterations(prompt_text, input_tokens)
-    output_tokens_per_iter = estimate_output_tokens_per_iteration(prompt_text, input_tokens)
-    total_output_tokens = output_tokens_per_iter * iterations
-    total_input_tokens = input_tokens * iterations
-
-    # Calculate costs
-    results = {}
-    for m in models:
-        cost = calculate_cost(total_input_tokens, total_output_tokens, m)
-        results[m] = {
-            "estimated_iterations": iterations,
-            "input_tokens_per_prompt": input_tokens,
-            "total_input_tokens": total_input_tokens,
-            "output_tokens_per_iteration": output_tokens_per_iter,
-            "total_output_tokens": total_output_tokens,
-            "estimated_cost_eur": cost
-        }
+    # Token estimation and costs
+    results = estimate_session(prompt_text, models, deterministic=args.deterministic)
 
     # Prepare display
     display_lines = []
     display_lines.append("⚠️ Estimated Total Coding Session Cost")
     display_lines.append("Heuristic: iterations & output tokens deduced from prompt length, keyword density, and quality.\n")
     for m, r in results.items():
-        display_lines.append(f"{m.title()}:")
-        display_lines.append(f"  Estimated Iterations: {r['estimated_iterations']}")
-        display_lines.append(f"  Input Tokens per Prompt: {r['input_tokens_per_prompt']}")
-        display_lines.append(f"  Total Input Tokens: {r['total_input_tokens']}")
-        display_lines.append(f"  Output Tokens per Iteration: {r['output_tokens_per_iteration']}")
-        display_lines.append(f"  Total Output Tokens: {r['total_output_tokens']}")
-        display_lines.append(f"  Estimated Total Cost (EUR): €{r['estimated_cost_eur']}\n")
-
-    # Display results
-    styled_lines = [("class:dialog.body", line + "\n") for line in display_lines]
-    print_formatted_text(FormattedText(styled_lines), style=retro_style)
+        display_lines.append(
+            f"{m.title()}:\n"
+            f"  Estimated Iterations: {r['estimated_iterations']}\n"
+            f"  Input Tokens per Prompt: {r['input_tokens_per_prompt']}\n"
+            f"  Total Input Tokens: {r['total_input_tokens']}\n"
+            f"  Output Tokens per Iteration: {r['output_tokens_per_iteration']}\n"
+            f"  Total Output Tokens: {r['total_output_tokens']}\n"
+            f"  Estimated Total Cost (EUR): €{r['estimated_cost_eur']}\n"
+        )
+
+    # Display results as one styled fragment: a single style resolution and
+    # terminal write, rather than one per line
+    body = "\n".join(display_lines) + "\n"
+    print_formatted_text(FormattedText((("class:dialog.body", body),)), style=retro_style)
 
     # Save last calculation
     save_last({
@@ -176,5 +340,13 @@ def main():
         "results": results
     })
 
+def _selftest():
+    # Sanity-check the precompiled keyword matcher: whole words and phrases
+    # count, keywords embedded in longer words ("classical") do not
+    hits = count_keyword_hits("refactor the unit test for this classical api")
+    if hits != 4:
+        raise RuntimeError(f"keyword matcher self-test failed: {hits} hits, expected 4")
+
 if __name__ == "__main__":
+    _selftest()
     main()
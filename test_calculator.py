@@ -0,0 +1,135 @@
+import math
+import os
+import random
+import tempfile
+import unittest
+from unittest import mock
+
+import calculator
+
+
+def baseline_cost(tokens_input, tokens_output, model):
+    # calculate_cost as originally written, before the rate tables
+    price = calculator.PRICING.get(model)
+    if not price:
+        return 0.0
+    cost_usd = (tokens_input / 1_000_000) * price["input_per_m"]
+    cost_usd += (tokens_output / 1_000_000) * price["output_per_m"]
+    return float(f"{cost_usd * calculator.USD_TO_EUR:.8f}")
+
+
+class DeterministicEstimateTests(unittest.TestCase):
+    PROMPT = "Refactor the API endpoint and add unit tests for these classes"
+    MODELS = ["claude", "gemini"]
+
+    def test_session_is_repeatable(self):
+        first = calculator.estimate_session(self.PROMPT, self.MODELS, deterministic=True)
+        calculator._analysis_cache.clear()
+        second = calculator.estimate_session(self.PROMPT, self.MODELS, deterministic=True)
+        self.assertEqual(first, second)
+        self.assertEqual(set(first), set(self.MODELS))
+
+    def test_batch_matches_session(self):
+        prompts = [self.PROMPT, "hi", "Write tests\nfor the database module"]
+        batch = calculator.estimate_batch(prompts, self.MODELS, deterministic=True)
+        single = [calculator.estimate_session(p, self.MODELS, deterministic=True) for p in prompts]
+        self.assertEqual(batch, single)
+
+    def test_jitter_stays_within_ten_percent(self):
+        for _ in range(500):
+            iterations = calculator.deduce_iterations(100, 10)
+            self.assertTrue(int(15 * 0.9) <= iterations <= int(15 * 1.1))
+
+
+class KeywordHitTests(unittest.TestCase):
+    def test_plurals_count_and_embedded_words_do_not(self):
+        hits = calculator.count_keyword_hits("write tests for these functions and classes")
+        self.assertEqual(hits, 3)
+        self.assertEqual(calculator.count_keyword_hits("a classical approach"), 0)
+
+    def test_phrases_count_alongside_their_words(self):
+        # "unit test" and "test" are distinct keywords
+        self.assertEqual(calculator.count_keyword_hits("add a unit test"), 2)
+
+    def test_selftest_passes(self):
+        calculator._selftest()
+
+
+class WordCountTests(unittest.TestCase):
+    def test_matches_split_on_edge_cases(self):
+        cases = [
+            "", " ", "a", " a b ", "a  b", "a\tb c", "a\nb", "a\rb",
+            "a\x0bb", "a\x0cb", "a\x1cb", "a\xa0b c", "a　b", "one two three",
+        ]
+        for text in cases:
+            self.assertEqual(calculator._count_words(text), len(text.split()), repr(text))
+
+    def test_matches_split_on_random_whitespace(self):
+        rng = random.Random(0)
+        alphabet = "ab \t\n\r\x0b\x0c\x1c\x1d\x1e\x1f\x85\xa0　"
+        for _ in range(50_000):
+            text = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 8)))
+            self.assertEqual(calculator._count_words(text), len(text.split()), repr(text))
+
+
+class FallbackTokenEstimateTests(unittest.TestCase):
+    def test_chars_matches_ceil_division(self):
+        for n in range(1_000):
+            self.assertEqual(calculator.estimate_tokens_by_chars("x" * n), max(1, math.ceil(n / 4)))
+
+    def test_words_matches_float_formula(self):
+        for n in range(3_000):
+            text = " ".join(["w"] * n)
+            self.assertEqual(calculator.estimate_tokens_by_words(text), max(1, int(n / 0.75)))
+
+
+class CostTests(unittest.TestCase):
+    def test_matches_baseline_formula(self):
+        rng = random.Random(0)
+        for _ in range(50_000):
+            tokens_input = rng.randint(0, 10**8)
+            tokens_output = rng.randint(0, 10**8)
+            for model in calculator.PRICING:
+                self.assertEqual(
+                    calculator.calculate_cost(tokens_input, tokens_output, model),
+                    baseline_cost(tokens_input, tokens_output, model),
+                )
+
+    def test_unknown_model_costs_nothing(self):
+        self.assertEqual(calculator.calculate_cost(1000, 1000, "unknown"), 0.0)
+
+
+class SaveLastTests(unittest.TestCase):
+    DATA = {"models": ["claude"], "prompt": "café €", "results": {"claude": {"estimated_cost_eur": 0.5}}}
+
+    def setUp(self):
+        self._cwd = os.getcwd()
+        self._tmp = tempfile.TemporaryDirectory()
+        os.chdir(self._tmp.name)
+
+    def tearDown(self):
+        os.chdir(self._cwd)
+        self._tmp.cleanup()
+
+    def _saved_bytes(self):
+        calculator.save_last(self.DATA)
+        with open("last_estimate.json", "rb") as f:
+            return f.read()
+
+    @unittest.skipIf(calculator.orjson is None, "orjson not installed")
+    def test_orjson_and_json_write_identical_bytes(self):
+        fast = self._saved_bytes()
+        with mock.patch.object(calculator, "orjson", None):
+            fallback = self._saved_bytes()
+        self.assertEqual(fast, fallback)
+
+    def test_overwrites_longer_previous_file(self):
+        with open("last_estimate.json", "w", encoding="utf-8") as f:
+            f.write("x" * 10_000)
+        saved = self._saved_bytes()
+        self.assertTrue(saved.endswith(b"}"))
+        self.assertIn("café €".encode("utf-8"), saved)
+
+
+if __name__ == "__main__":
+    unittest.main()